@@ -1,14 +1,18 @@
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
 from werkzeug.utils import secure_filename
 import os
+import json
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import uuid
-from rag_engine import RAGEngine
+from rag_engine import RAGEngine, parse_and_chunk, http_client
 
-app = Flask(__name__)
-CORS(app)
+app = Quart(__name__)
+app = cors(app)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
@@ -21,14 +25,35 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 # Initialize RAG Engine
 rag_engine = RAGEngine()
 
+# Text extraction and chunking are CPU-bound pure Python, so uploads fan them
+# out across processes; embedding stays in this process where the model lives.
+# Created per serving process in start_parse_pool: a pool made at import time
+# would be shared by every worker forked from a preloading gunicorn master.
+parse_pool = None
+
 # Create upload folder if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@app.before_serving
+async def start_parse_pool():
+    global parse_pool
+    # Pool processes come from a forkserver rather than forking this process,
+    # which already runs torch and encode worker threads; the server imports
+    # rag_engine once so each pool process starts from a warm copy
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['rag_engine'])
+    parse_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=context)
+
+@app.after_serving
+async def close_http_client():
+    await http_client.aclose()
+    parse_pool.shutdown(wait=False, cancel_futures=True)
+
 @app.route('/api/health', methods=['GET'])
-def health_check():
+async def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
@@ -37,17 +62,36 @@ def health_check():
     })
 
 @app.route('/api/upload', methods=['POST'])
-def upload_documents():
+async def upload_documents():
     """Upload and process documents"""
-    if 'files' not in request.files:
+    request_files = await request.files
+    if 'files' not in request_files:
         return jsonify({'error': 'No files provided'}), 400
     
-    files = request.files.getlist('files')
+    files = request_files.getlist('files')
     if not files or files[0].filename == '':
         return jsonify({'error': 'No files selected'}), 400
     
+    loop = asyncio.get_running_loop()
+    
+    async def process(file_id, filepath, filename):
+        chunks, filename = await loop.run_in_executor(parse_pool, parse_and_chunk, filepath, filename)
+        
+        # Process document with RAG engine
+        doc_info = await asyncio.to_thread(rag_engine.ingest_chunks, chunks, filepath, filename)
+        
+        return {
+            'id': file_id,
+            'name': filename,
+            'size': os.path.getsize(filepath),
+            'processed': True,
+            'chunks': doc_info['chunks'],
+            'uploaded_at': datetime.now().isoformat()
+        }
+    
     results = []
     errors = []
+    pending = []
     
     for file in files:
         if file and allowed_file(file.filename):
@@ -56,19 +100,9 @@ def upload_documents():
                 file_id = str(uuid.uuid4())
                 filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}_{filename}")
                 
-                file.save(filepath)
+                await file.save(filepath)
                 
-                # Process document with RAG engine
-                doc_info = rag_engine.ingest_document(filepath, filename)
-                
-                results.append({
-                    'id': file_id,
-                    'name': filename,
-                    'size': os.path.getsize(filepath),
-                    'processed': True,
-                    'chunks': doc_info['chunks'],
-                    'uploaded_at': datetime.now().isoformat()
-                })
+                pending.append((file.filename, process(file_id, filepath, filename)))
             except Exception as e:
                 errors.append({
                     'filename': file.filename,
@@ -80,6 +114,16 @@ def upload_documents():
                 'error': 'File type not allowed'
             })
     
+    outcomes = await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+    for (original_name, _), outcome in zip(pending, outcomes):
+        if isinstance(outcome, Exception):
+            errors.append({
+                'filename': original_name,
+                'error': str(outcome)
+            })
+        else:
+            results.append(outcome)
+    
     return jsonify({
         'success': results,
         'errors': errors,
@@ -87,9 +131,9 @@ def upload_documents():
     }), 200 if not errors else 207
 
 @app.route('/api/search', methods=['POST'])
-def search():
+async def search():
     """Search across documents using RAG"""
-    data = request.get_json()
+    data = await request.get_json()
     
     if not data or 'query' not in data:
         return jsonify({'error': 'Query is required'}), 400
@@ -101,9 +145,26 @@ def search():
     if len(rag_engine.documents) == 0:
         return jsonify({'error': 'No documents indexed. Please upload documents first.'}), 400
     
+    top_k = data.get('top_k', 5)
+    
+    if data.get('stream'):
+        # Server-sent events: a 'meta' event with sources and confidence, then
+        # 'delta' events with answer text as the LLM produces it
+        async def generate():
+            try:
+                async for event in rag_engine.search_stream(query, top_k=top_k):
+                    if event['event'] == 'meta':
+                        event = {**event, 'query': query, 'timestamp': datetime.now().isoformat()}
+                    yield f"data: {json.dumps(event)}\n\n"
+            except Exception as e:
+                yield f"data: {json.dumps({'event': 'error', 'error': f'Search failed: {str(e)}'})}\n\n"
+            yield f"data: {json.dumps({'event': 'done'})}\n\n"
+        
+        return Response(generate(), mimetype='text/event-stream')
+    
     try:
         # Perform RAG search
-        result = rag_engine.search(query, top_k=data.get('top_k', 5))
+        result = await rag_engine.search(query, top_k=top_k)
         
         return jsonify({
             'query': query,
@@ -111,6 +172,7 @@ def search():
             'sources': result['sources'],
             'confidence': result['confidence'],
             'retrieved_chunks': result['retrieved_chunks'],
+            'cached': result['cached'],
             'timestamp': datetime.now().isoformat()
         }), 200
         
@@ -118,7 +180,7 @@ def search():
         return jsonify({'error': f'Search failed: {str(e)}'}), 500
 
 @app.route('/api/documents', methods=['GET'])
-def list_documents():
+async def list_documents():
     """List all indexed documents"""
     docs = [
         {
@@ -132,9 +194,9 @@ def list_documents():
     return jsonify({'documents': docs, 'total': len(docs)}), 200
 
 @app.route('/api/documents/<doc_id>', methods=['DELETE'])
-def delete_document(doc_id):
+async def delete_document(doc_id):
     """Delete a document from the index"""
-    success = rag_engine.remove_document(doc_id)
+    success = await asyncio.to_thread(rag_engine.remove_document, doc_id)
     
     if success:
         return jsonify({'message': 'Document deleted successfully'}), 200
@@ -142,9 +204,9 @@ def delete_document(doc_id):
         return jsonify({'error': 'Document not found'}), 404
 
 @app.route('/api/clear', methods=['POST'])
-def clear_all():
+async def clear_all():
     """Clear all documents"""
-    rag_engine.clear_all()
+    await asyncio.to_thread(rag_engine.clear_all)
     return jsonify({'message': 'All documents cleared'}), 200
 
 if __name__ == '__main__':
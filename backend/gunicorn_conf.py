@@ -0,0 +1,26 @@
+# Gunicorn settings for the backend: gunicorn -c gunicorn_conf.py app:app
+import os
+import torch
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# The app is ASGI (Quart): each worker runs one event loop, and searches
+# overlap their LLM calls on it instead of each holding a thread. Uvicorn
+# picks uvloop and httptools automatically when installed (uvicorn[standard]).
+worker_class = 'uvicorn.workers.UvicornWorker'
+timeout = 60
+
+# One worker: the index lives in process memory and is persisted to a single
+# index_store/ whose doc ids and snapshots that process allocates, so a second
+# worker would overwrite its files (RAGEngine locks the directory to refuse
+# that). Concurrency comes from the worker's event loop instead.
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+if workers != 1:
+    raise RuntimeError("GUNICORN_WORKERS must be 1: the persisted index has a single writer")
+
+# On CPU hosts, load the app (embedding model, index) once in the master and
+# fork workers from it, so model weights are shared copy-on-write instead of
+# reloaded. On GPU hosts the model is placed on CUDA at load time, and CUDA
+# can't be used in a process forked after it was initialized, so each worker
+# loads the app itself. (is_available() doesn't initialize CUDA.)
+preload_app = not torch.cuda.is_available()
@@ -1,124 +1,913 @@
 import numpy as np
+import asyncio
+import faiss
+import torch
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import os
-from typing import List, Dict
+import sys
+import gc
+import glob
+import hashlib
+import io
+import json
+import queue
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Iterable, Iterator, AsyncIterator, Tuple
 from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+import scipy.sparse as sp
+from numba import njit
 import PyPDF2
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 import docx
-import requests
+import httpx
+
+# 10k cached 384-dim float32 query vectors is ~15MB, well under a 100MB budget
+QUERY_CACHE_SIZE = 10000
+
+# Semantic result cache: a prior answer is reused when a new query's embedding
+# is at least this cosine-similar to the one it was computed for
+RESULT_CACHE_SIZE = 1000
+RESULT_CACHE_THRESHOLD = 0.9
+RESULT_CACHE_TTL = 3600  # seconds
+
+# Once this many chunks are indexed, vectors are scalar-quantized to 8 bits
+# (4x smaller than float32); the first batch of that size trains the quantizer
+SQ_TRAIN_SIZE = 10000
+
+# chunk_text gathers this many characters of new text before scanning for windows
+EMIT_MIN_CHARS = 1 << 16
+
+# Chunks are embedded and spilled to disk this many at a time during ingestion
+INGEST_BATCH_SIZE = 64
+# Force a garbage collection pass every this many spilled batches
+GC_EVERY_FLUSHES = 16
+
+# Threads used by the PyPDF2 fallback to extract PDF pages; 0 or 1 extracts
+# serially. Off by default: extraction holds the GIL and every thread parses
+# the file again, so threads only pay off on unusually expensive pages.
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', '1'))
+
+HNSW_EF_SEARCH = 64
+
+# Concurrent query embeddings are gathered into one encode() call: up to this
+# many queries, waiting at most this long after the first one arrives
+QUERY_BATCH_SIZE = 16
+QUERY_BATCH_WAIT = 0.005  # seconds
+
+# Once vectors live in the HNSW index, a BM25 keyword pass restricts the graph
+# search to the BM25_CANDIDATES best matching chunks (Okapi k1 and b below)
+BM25_CANDIDATES = 500
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Every save writes a complete snapshot into a new SNAPSHOT_PREFIX directory of
+# RAGEngine.persist_dir, then atomically points CURRENT_FILE at it
+CURRENT_FILE = 'CURRENT'
+# Held with an exclusive flock by the one process allowed to write the directory
+LOCK_FILE = 'LOCK'
+SNAPSHOT_PREFIX = 'snapshot-'
+STATE_FILE = 'documents.json'
+CHUNKS_FILE = 'chunks.parquet'
+VECTORS_FILE = 'vectors.npy'
+INDEX_FILE = 'index.faiss'
+
+# Only this many top chunks go into the prompt, each cut to CHUNK_HEAD_CHARS;
+# that head is all that is kept in memory, the full text stays in the shards
+CONTEXT_CHUNKS = 3
+CHUNK_HEAD_CHARS = 400
+
+NO_RESULTS_ANSWER = 'No relevant information found in the indexed documents.'
+
+# Shared async LLM client: pooled keep-alive connections (HTTP/2 where offered),
+# so searches reuse an open TLS session and many can await the LLM at once.
+# Used from the server's single event loop; closed by the app on shutdown.
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_keepalive_connections=32)
+)
+
+def _iter_pdf_pages_pdfium(filepath: str) -> Iterator[str]:
+    """Yield PDF page texts in order using PDFium (native parser)"""
+    # PDFium reads the file on demand rather than loading it into Python, and
+    # is not thread-safe, so pages are extracted serially
+    pdf = pdfium.PdfDocument(filepath)
+    try:
+        for page in pdf:
+            textpage = page.get_textpage()
+            yield textpage.get_text_range()
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+
+def _iter_pdf_pages_pypdf2(filepath: str) -> Iterator[str]:
+    """Yield PDF page texts in order, extracting up to PDF_EXTRACT_WORKERS pages concurrently"""
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    num_pages = len(PyPDF2.PdfReader(io.BytesIO(data)).pages)
+    
+    if PDF_EXTRACT_WORKERS <= 1 or num_pages <= 1:
+        for page in PyPDF2.PdfReader(io.BytesIO(data)).pages:
+            yield page.extract_text() or ''
+        return
+    
+    # A PdfReader seeks on its stream while resolving objects, so each thread
+    # gets its own reader over the shared bytes
+    local = threading.local()
+    
+    def extract(page_num):
+        if not hasattr(local, 'reader'):
+            local.reader = PyPDF2.PdfReader(io.BytesIO(data))
+        return local.reader.pages[page_num].extract_text() or ''
+    
+    with ThreadPoolExecutor(max_workers=PDF_EXTRACT_WORKERS) as executor:
+        yield from executor.map(extract, range(num_pages))
+
+def _iter_pdf_pages(filepath: str) -> Iterator[str]:
+    """Yield PDF page texts, preferring PDFium and falling back to PyPDF2"""
+    if pdfium is not None:
+        pages = _iter_pdf_pages_pdfium(filepath)
+        try:
+            first = next(pages, None)
+        except Exception as e:
+            # Fall back only if PDFium can't open the file at all; once pages
+            # have been yielded, switching parsers would duplicate text
+            print(f"PDFium failed, falling back to PyPDF2: {e}")
+        else:
+            if first is not None:
+                yield first
+                yield from pages
+            return
+    
+    yield from _iter_pdf_pages_pypdf2(filepath)
+
+def iter_file_pages(filepath: str) -> Iterator[str]:
+    """Yield the text of a file piece by piece (pages, paragraphs or lines)"""
+    ext = filepath.lower().split('.')[-1]
+
+    if ext == 'txt':
+        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+            yield from f
+
+    elif ext == 'pdf':
+        try:
+            yield from _iter_pdf_pages(filepath)
+        except Exception as e:
+            raise ValueError(f"Error reading PDF: {str(e)}")
+
+    elif ext == 'docx':
+        try:
+            doc = docx.Document(filepath)
+            for paragraph in doc.paragraphs:
+                yield paragraph.text
+        except Exception as e:
+            raise ValueError(f"Error reading DOCX: {str(e)}")
+
+    else:
+        raise ValueError(f"Unsupported file format: {ext}")
+
+@njit(cache=True)
+def _is_space(c):
+    # Same code points str.split() treats as whitespace
+    return (
+        (9 <= c <= 13) or (28 <= c <= 32) or c == 0x85 or c == 0xA0 or c == 0x1680
+        or (0x2000 <= c <= 0x200A) or c == 0x2028 or c == 0x2029 or c == 0x202F
+        or c == 0x205F or c == 0x3000
+    )
+
+@njit(cache=True)
+def _word_spans(codepoints):
+    """Start and end character offsets of every whitespace-delimited word"""
+    n = codepoints.shape[0]
+    starts = np.empty(n // 2 + 1, dtype=np.int32)
+    ends = np.empty(n // 2 + 1, dtype=np.int32)
+    count = 0
+    in_word = False
+    for i in range(n):
+        if _is_space(codepoints[i]):
+            if in_word:
+                ends[count] = i
+                count += 1
+                in_word = False
+        elif not in_word:
+            starts[count] = i
+            in_word = True
+    if in_word:
+        ends[count] = n
+        count += 1
+    return starts[:count], ends[:count]
+
+@njit(cache=True)
+def _window_spans(starts, ends, chunk_size, step, final):
+    """(start_char, end_char) of each word window; windows begin every `step` words.
+    
+    Unless `final`, only windows with a full `chunk_size` words are returned, since
+    later text may still extend the rest.
+    """
+    n = starts.shape[0]
+    if final:
+        count = (n + step - 1) // step
+    elif n < chunk_size:
+        count = 0
+    else:
+        count = (n - chunk_size) // step + 1
+    
+    spans = np.empty((count, 2), dtype=np.int32)
+    for w in range(count):
+        first = w * step
+        last = min(first + chunk_size, n) - 1
+        spans[w, 0] = starts[first]
+        spans[w, 1] = ends[last]
+    return spans
+
+def chunk_text(pages: Iterable[str], chunk_size: int = 500, overlap: int = 50) -> Iterator[str]:
+    """Yield overlapping word-window chunks from text or an iterable of page texts"""
+    if isinstance(pages, str):
+        pages = [pages]
+    
+    step = chunk_size - overlap
+    # Text not yet fully covered by emitted windows; chunks are slices of it,
+    # so no per-chunk join of word lists is needed
+    pending = ''
+    # Pieces (TXT lines, say) are buffered and scanned EMIT_MIN_CHARS at a time,
+    # so the encode and word scan run once per block rather than once per piece
+    buffered = []
+    buffered_chars = 0
+    
+    def emit(final):
+        nonlocal pending
+        # UTF-32 gives one fixed-width code point per character, so offsets
+        # found on the array are valid str indices
+        codepoints = np.frombuffer(pending.encode('utf-32-le'), dtype=np.uint32)
+        starts, ends = _word_spans(codepoints)
+        spans = _window_spans(starts, ends, chunk_size, step, final)
+        
+        for start, end in spans:
+            yield pending[start:end]
+        
+        consumed = len(spans) * step
+        pending = '' if final or consumed >= len(starts) else pending[starts[consumed]:]
+    
+    def flush():
+        nonlocal pending, buffered, buffered_chars
+        pending = '\n'.join([pending, *buffered] if pending else buffered)
+        buffered = []
+        buffered_chars = 0
+    
+    for page in pages:
+        buffered.append(page)
+        buffered_chars += len(page)
+        if buffered_chars >= EMIT_MIN_CHARS:
+            flush()
+            yield from emit(final=False)
+    
+    flush()
+    yield from emit(final=True)
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens for BM25"""
+    return re.findall(r'\w+', text.lower())
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, in O(n + k log k)"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part])]
+
+def parse_and_chunk(filepath: str, filename: str):
+    """Extract and chunk a file; top-level so it can run in a worker process"""
+    return list(chunk_text(iter_file_pages(filepath))), filename
 
 class RAGEngine:
-    def __init__(self, embedding_model='all-MiniLM-L6-v2'):
+    def __init__(self, embedding_model='all-MiniLM-L6-v2', persist_dir='index_store'):
         """Initialize RAG engine with embedding model"""
-        self.embedding_model = SentenceTransformer(embedding_model)
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.embedding_model = SentenceTransformer(embedding_model, device=self.device)
+        if self.device == 'cuda':
+            # FP16 halves weight and activation traffic on the GPU
+            self.embedding_model.half()
+        self.embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
         self.documents = []
-        self.embeddings = []
-        self.chunks = []
+        self._next_doc_id = 0
+        # Index state is written here after every change and reloaded on startup;
+        # shards/ holds per-document Parquet (text, embedding) rows written at ingest
+        self.persist_dir = persist_dir
+        self.shard_dir = os.path.join(persist_dir, 'shards')
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self._lock_persist_dir()
+        self._snapshot_version = 0
+        # Chunk metadata as parallel arrays (struct-of-arrays); row i of the vector
+        # store belongs to chunk i. Document names are stored once per document, and
+        # only the first CHUNK_HEAD_CHARS of each chunk's text are kept in memory.
+        # Small corpora keep contiguous normalized float32 rows in _emb_matrix and
+        # are scored exactly with one matrix-vector product; from SQ_TRAIN_SIZE
+        # chunks on they move into a quantized HNSW index and _emb_matrix is emptied.
+        self.chunk_heads = []
+        self.chunk_doc_ids = np.empty(0, dtype=np.int32)
+        self.chunk_nums = np.empty(0, dtype=np.int32)
+        self.doc_names = {}
+        self._emb_matrix = np.empty((0, self.embedding_dim), dtype=np.float32)
+        self.index = None
+        # BM25 postings, kept only while the index is quantized: _term_blocks holds
+        # each document's (chunks x terms) token counts over the shared _term_vocab,
+        # tokenized from its shard on first need. After every change they are merged
+        # into _bm25 = (corpus generation, CSC term frequencies, length norms),
+        # outside _index_lock; searches use whichever _bm25 matches the corpus.
+        # _term_blocks is guarded by _index_lock, _term_vocab by _bm25_lock.
+        self._term_vocab = {}
+        self._term_blocks = {}
+        self._bm25 = None
+        self._bm25_lock = threading.Lock()
+        # Guards documents, chunk metadata, the vector store and the doc id counter; threads
+        # of a gthread worker share this state. Reentrant so helpers can nest it.
+        self._index_lock = threading.RLock()
+        self._load()
+        
+        # LRU cache of normalized query embeddings keyed by SHA-256 of the query
+        self._query_emb_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        
+        # Cache misses are queued as (query, Future) for the encode worker thread,
+        # started on first use (a thread started before a fork would not survive)
+        self._encode_queue = queue.Queue()
+        self._encode_worker = None
+        self._encode_worker_pid = None
+        self._encode_worker_lock = threading.Lock()
+        
+        # Semantic cache of search() results; row i of the index holds the query
+        # embedding for self._result_cache_entries[i] = (inserted_at, top_k, result)
+        self._result_cache_index = faiss.IndexFlatIP(self.embedding_dim)
+        self._result_cache_entries = []
+        self._result_cache_lock = threading.Lock()
+        # Bumped on every corpus change; a search only caches its result if the
+        # corpus it retrieved from is still current
+        self._corpus_generation = 0
+        
+        # Rank weights for confidence: the top chunk counts most
+        self._conf_weights = np.array([1.0, 0.8, 0.6, 0.4, 0.2], dtype=np.float32)
         
         # Support multiple API providers
         self.api_key = os.getenv('GROQ_API_KEY') or os.getenv('OPENAI_API_KEY')
         self.api_provider = 'groq' if os.getenv('GROQ_API_KEY') else 'openai'
         
+    def iter_file_pages(self, filepath: str) -> Iterator[str]:
+        """Yield the text of a file piece by piece (pages, paragraphs or lines)"""
+        return iter_file_pages(filepath)
+    
+    def chunk_text(self, pages: Iterable[str], chunk_size: int = 500, overlap: int = 50) -> Iterator[str]:
+        """Yield overlapping word-window chunks from text or an iterable of page texts"""
+        return chunk_text(pages, chunk_size, overlap)
+    
     def extract_text_from_file(self, filepath: str) -> str:
         """Extract text from various file formats"""
-        ext = filepath.lower().split('.')[-1]
+        return '\n'.join(self.iter_file_pages(filepath))
+    
+    def _new_index(self):
+        """Create an empty 8-bit scalar-quantized HNSW index scoring by inner product"""
+        index = faiss.IndexHNSWSQ(
+            self.embedding_dim, faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = 200
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    
+    def _lock_persist_dir(self):
+        """Claim persist_dir for this process (and any workers forked from it)"""
+        # Doc ids and snapshot versions are allocated in memory, so two processes
+        # writing one directory would overwrite each other's shards and snapshots
+        self._persist_lock_file = open(os.path.join(self.persist_dir, LOCK_FILE), 'w')
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._persist_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._persist_lock_file.close()
+            raise RuntimeError(
+                f"{self.persist_dir} is already in use by another process; "
+                "each index directory must be served by a single worker"
+            )
+    
+    def _persist_path(self, name: str, version: int = None) -> str:
+        """Path of a file in the given (default: current) snapshot directory"""
+        if version is None:
+            version = self._snapshot_version
+        return os.path.join(self.persist_dir, f"{SNAPSHOT_PREFIX}{version:08d}", name)
+    
+    def _save(self):
+        """Write documents, chunk metadata and vectors as a new snapshot (caller holds the lock)"""
+        version = self._snapshot_version + 1
+        os.makedirs(os.path.dirname(self._persist_path(STATE_FILE, version)), exist_ok=True)
         
-        if ext == 'txt':
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                return f.read()
+        if self.index is not None:
+            faiss.write_index(self.index, self._persist_path(INDEX_FILE, version))
+        else:
+            with open(self._persist_path(VECTORS_FILE, version), 'wb') as f:
+                np.save(f, self._emb_matrix)
         
-        elif ext == 'pdf':
-            text = []
-            try:
-                with open(filepath, 'rb') as f:
-                    pdf_reader = PyPDF2.PdfReader(f)
-                    for page in pdf_reader.pages:
-                        text.append(page.extract_text())
-                return '\n'.join(text)
-            except Exception as e:
-                raise ValueError(f"Error reading PDF: {str(e)}")
+        pq.write_table(pa.table({
+            'head': pa.array(self.chunk_heads, type=pa.string()),
+            'doc_id': self.chunk_doc_ids,
+            'chunk_num': self.chunk_nums
+        }), self._persist_path(CHUNKS_FILE, version))
+        
+        with open(self._persist_path(STATE_FILE, version), 'w', encoding='utf-8') as f:
+            json.dump({'next_doc_id': self._next_doc_id, 'documents': self.documents}, f)
+        
+        # Swapping the pointer is the commit: a crash before it leaves the previous
+        # snapshot current, a crash after it leaves only stale directories behind
+        current_path = os.path.join(self.persist_dir, CURRENT_FILE)
+        with open(current_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(str(version))
+        os.replace(current_path + '.tmp', current_path)
+        self._snapshot_version = version
+        self._remove_stale_snapshots()
+    
+    def _remove_stale_snapshots(self):
+        current = os.path.dirname(self._persist_path(STATE_FILE))
+        for snapshot_dir in glob.glob(os.path.join(self.persist_dir, SNAPSHOT_PREFIX + '*')):
+            if snapshot_dir != current:
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+    
+    def _load(self):
+        """Restore the current snapshot, memory-mapping exact-path vectors instead of reading them"""
+        current_path = os.path.join(self.persist_dir, CURRENT_FILE)
+        if not os.path.exists(current_path):
+            return
+        
+        with open(current_path, 'r', encoding='utf-8') as f:
+            self._snapshot_version = int(f.read())
+        # Left over from a save that crashed before its pointer swap
+        self._remove_stale_snapshots()
+        
+        with open(self._persist_path(STATE_FILE), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        
+        if os.path.exists(self._persist_path(INDEX_FILE)):
+            # HNSW and quantized storage are always read fully into memory
+            self.index = faiss.read_index(self._persist_path(INDEX_FILE))
+            # Search-time parameters are not part of the serialized index
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
+        else:
+            self._emb_matrix = np.load(self._persist_path(VECTORS_FILE), mmap_mode='r')
+        
+        chunks = pq.read_table(pa.memory_map(self._persist_path(CHUNKS_FILE)))
+        self.chunk_heads = chunks.column('head').to_pylist()
+        self.chunk_doc_ids = chunks.column('doc_id').to_numpy()
+        self.chunk_nums = chunks.column('chunk_num').to_numpy()
+        
+        self.documents = state['documents']
+        self._next_doc_id = state['next_doc_id']
+        for doc in self.documents:
+            doc['name'] = sys.intern(doc['name'])
+        self.doc_names = {int(doc['id']): doc['name'] for doc in self.documents}
+        
+        # Shards of ingests that never reached a snapshot, or of removals whose
+        # snapshot was saved but whose shard was not yet deleted
+        for shard_path in glob.glob(os.path.join(self.shard_dir, '*_chunks.parquet')):
+            doc_id = int(os.path.basename(shard_path).split('_')[0])
+            if doc_id not in self.doc_names:
+                os.remove(shard_path)
+    
+    def _num_vectors(self) -> int:
+        return self.index.ntotal if self.index is not None else len(self._emb_matrix)
+    
+    def _read_shard_vectors(self, doc_id: int) -> np.ndarray:
+        """The exact float32 embeddings of a document, from its shard"""
+        shard = pq.read_table(self._shard_path(doc_id), columns=['embedding'], memory_map=True)
+        embeddings = shard.column('embedding').combine_chunks().flatten().to_numpy()
+        return embeddings.reshape(-1, self.embedding_dim)
+    
+    def _build_store(self, vectors: np.ndarray):
+        """(index, emb_matrix) holding vectors, quantizing once there are enough to train on"""
+        # Every source (encoder output, shard embeddings) is already unit length,
+        # so rows are neither copied again nor re-normalized here
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(vectors) < SQ_TRAIN_SIZE:
+            return None, vectors
         
-        elif ext == 'docx':
+        index = self._new_index()
+        index.train(vectors)
+        index.add(vectors)
+        return index, np.empty((0, self.embedding_dim), dtype=np.float32)
+    
+    def _set_vectors(self, vectors: np.ndarray):
+        """Replace the vector store"""
+        self.index, self._emb_matrix = self._build_store(vectors)
+    
+    def _add_to_index(self, vectors: np.ndarray):
+        """Append vectors to the store, switching to the quantized index at SQ_TRAIN_SIZE"""
+        if self.index is not None:
+            self.index.add(vectors)
+        else:
+            # Crossing SQ_TRAIN_SIZE trains the quantizer on everything accumulated so far
+            self._set_vectors(np.vstack([self._emb_matrix, vectors]))
+    
+    def _encode_chunks(self, chunks: List[str]) -> np.ndarray:
+        """Embed chunks in fixed-size batches as normalized float32 vectors"""
+        # encode() already groups inputs by length before batching, so padding
+        # per batch stays small without sorting here. Results stay on the device
+        # (normalized there) and come back to the host in one copy per call.
+        embeddings = self.embedding_model.encode(
+            chunks,
+            batch_size=128 if self.device == 'cuda' else 64,
+            convert_to_numpy=False,
+            convert_to_tensor=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        embeddings = np.ascontiguousarray(embeddings.cpu().numpy(), dtype=np.float32)
+        # Re-normalize after the float32 cast (FP16 output drifts off unit length)
+        faiss.normalize_L2(embeddings)
+        return embeddings
+    
+    def _ensure_encode_worker(self):
+        """Start the query encode worker in this process if it is not running"""
+        with self._encode_worker_lock:
+            if self._encode_worker_pid == os.getpid() and self._encode_worker.is_alive():
+                return
+            self._encode_worker = threading.Thread(
+                target=self._run_encode_worker, name='encode_worker', daemon=True
+            )
+            self._encode_worker_pid = os.getpid()
+            self._encode_worker.start()
+    
+    def _run_encode_worker(self):
+        """Embed queued queries in batches and resolve their futures"""
+        while True:
+            batch = [self._encode_queue.get()]
+            deadline = time.monotonic() + QUERY_BATCH_WAIT
+            while len(batch) < QUERY_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._encode_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            queries = list(dict.fromkeys(query for query, _ in batch))
             try:
-                doc = docx.Document(filepath)
-                return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
+                embeddings = self._encode_chunks(queries)
             except Exception as e:
-                raise ValueError(f"Error reading DOCX: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            rows = {query: i for i, query in enumerate(queries)}
+            for query, future in batch:
+                row = rows[query]
+                # Copied so a cached embedding doesn't keep the whole batch alive
+                future.set_result(embeddings[row:row + 1].copy())
+    
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Embed one query, batched with any others arriving concurrently"""
+        self._ensure_encode_worker()
+        future = Future()
+        self._encode_queue.put((query, future))
+        return future.result()
+    
+    def _embed_query(self, query: str) -> np.ndarray:
+        """Return the normalized (1, dim) float32 embedding for a query, cached"""
+        key = hashlib.sha256(query.encode('utf-8')).digest()
         
-        else:
-            raise ValueError(f"Unsupported file format: {ext}")
+        with self._query_cache_lock:
+            cached = self._query_emb_cache.get(key)
+            if cached is not None:
+                self._query_emb_cache.move_to_end(key)
+                return cached
+        
+        # Encode outside the lock; concurrent misses share one batched encode() call
+        query_embedding = self._encode_query(query)
+        
+        with self._query_cache_lock:
+            self._query_emb_cache[key] = query_embedding
+            self._query_emb_cache.move_to_end(key)
+            while len(self._query_emb_cache) > QUERY_CACHE_SIZE:
+                self._query_emb_cache.popitem(last=False)
+        
+        return query_embedding
     
-    def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-        """Split text into overlapping chunks"""
-        words = text.split()
-        chunks = []
+    def _lookup_cached_result(self, query_embedding: np.ndarray, top_k: int):
+        """Return a cached search result for a near-identical query, if any"""
+        with self._result_cache_lock:
+            if self._result_cache_index.ntotal == 0:
+                return None
+            
+            scores, indices = self._result_cache_index.search(query_embedding, 1)
+            idx = indices[0][0]
+            if idx < 0 or scores[0][0] < RESULT_CACHE_THRESHOLD:
+                return None
+            
+            inserted_at, cached_top_k, result = self._result_cache_entries[idx]
+            if cached_top_k != top_k or time.monotonic() - inserted_at > RESULT_CACHE_TTL:
+                return None
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk.strip():
-                chunks.append(chunk)
+        return {**result, 'cached': True}
+    
+    def _cache_result(self, query_embedding: np.ndarray, top_k: int, result: Dict, generation: int):
+        """Store a search result in the semantic cache, evicting the oldest entry when full"""
+        with self._result_cache_lock:
+            if generation != self._corpus_generation:
+                # Documents were added or removed while this search ran
+                return
+            
+            if self._result_cache_index.ntotal >= RESULT_CACHE_SIZE:
+                # IndexFlat compacts on removal, so rows stay aligned with the list
+                self._result_cache_index.remove_ids(np.array([0], dtype=np.int64))
+                self._result_cache_entries.pop(0)
+            
+            self._result_cache_index.add(query_embedding)
+            self._result_cache_entries.append((time.monotonic(), top_k, result))
+    
+    def _invalidate_result_cache(self):
+        """Drop all cached search results (the indexed corpus changed)"""
+        with self._result_cache_lock:
+            self._corpus_generation += 1
+            self._result_cache_index.reset()
+            self._result_cache_entries = []
+    
+    def _shard_path(self, doc_id: int) -> str:
+        return os.path.join(self.shard_dir, f"{doc_id}_chunks.parquet")
+    
+    def _spill_chunks(self, chunks: Iterable[str], shard_path: str) -> int:
+        """Embed chunks in mini-batches and append (text, embedding) rows to a Parquet shard"""
+        schema = pa.schema([
+            ('text', pa.string()),
+            ('embedding', pa.list_(pa.float32(), self.embedding_dim))
+        ])
         
-        return chunks
+        count = 0
+        flushes = 0
+        batch = []
+        
+        with pq.ParquetWriter(shard_path, schema) as writer:
+            def flush():
+                embeddings = self._encode_chunks(batch)
+                writer.write_batch(pa.RecordBatch.from_arrays([
+                    pa.array(batch, type=pa.string()),
+                    pa.FixedSizeListArray.from_arrays(pa.array(embeddings.ravel()), self.embedding_dim)
+                ], schema=schema))
+            
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) == INGEST_BATCH_SIZE:
+                    flush()
+                    count += len(batch)
+                    batch = []
+                    flushes += 1
+                    if flushes % GC_EVERY_FLUSHES == 0:
+                        gc.collect()
+            
+            if batch:
+                flush()
+                count += len(batch)
+        
+        return count
     
     def ingest_document(self, filepath: str, filename: str) -> Dict:
         """Process and index a document"""
-        text = self.extract_text_from_file(filepath)
-        
-        if not text.strip():
-            raise ValueError("Document appears to be empty")
+        return self.ingest_chunks(self.chunk_text(self.iter_file_pages(filepath)), filepath, filename)
+    
+    def ingest_chunks(self, chunks: Iterable[str], filepath: str, filename: str) -> Dict:
+        """Embed and index already-extracted chunks of a document"""
+        filename = sys.intern(filename)
+        with self._index_lock:
+            doc_id = self._next_doc_id
+            self._next_doc_id += 1
+        shard_path = self._shard_path(doc_id)
         
-        doc_chunks = self.chunk_text(text)
+        try:
+            num_chunks = self._spill_chunks(chunks, shard_path)
+        except Exception:
+            if os.path.exists(shard_path):
+                os.remove(shard_path)
+            raise
         
-        if not doc_chunks:
-            raise ValueError("No content could be extracted from document")
+        if num_chunks == 0:
+            os.remove(shard_path)
+            raise ValueError("Document appears to be empty")
         
-        chunk_embeddings = self.embedding_model.encode(doc_chunks)
+        # Read back from the shard before taking the lock; only one document's
+        # vectors and heads are materialized at a time
+        vectors = self._read_shard_vectors(doc_id)
+        heads = [
+            text[:CHUNK_HEAD_CHARS]
+            for record_batch in pq.ParquetFile(shard_path).iter_batches(batch_size=INGEST_BATCH_SIZE, columns=['text'])
+            for text in record_batch.column('text').to_pylist()
+        ]
         
-        doc_id = str(len(self.documents))
         doc_info = {
-            'id': doc_id,
+            'id': str(doc_id),
             'name': filename,
             'filepath': filepath,
-            'chunks': len(doc_chunks),
+            'chunks': num_chunks,
             'indexed_at': datetime.now().isoformat()
         }
         
-        self.documents.append(doc_info)
-        
-        for i, (chunk, embedding) in enumerate(zip(doc_chunks, chunk_embeddings)):
-            self.chunks.append({
-                'doc_id': doc_id,
-                'doc_name': filename,
-                'chunk_id': f"{doc_id}_{i}",
-                'text': chunk,
-                'embedding': embedding
-            })
+        with self._index_lock:
+            self.documents.append(doc_info)
+            self.doc_names[doc_id] = filename
+            self._invalidate_result_cache()
+            
+            # One append per document: below SQ_TRAIN_SIZE every append re-stacks _emb_matrix
+            self._add_to_index(vectors)
+            self.chunk_heads.extend(heads)
+            
+            self.chunk_doc_ids = np.concatenate([
+                self.chunk_doc_ids, np.full(num_chunks, doc_id, dtype=np.int32)
+            ])
+            self.chunk_nums = np.concatenate([
+                self.chunk_nums, np.arange(num_chunks, dtype=np.int32)
+            ])
+            self._save()
         
+        self._refresh_bm25()
         return doc_info
     
-    def retrieve_relevant_chunks(self, query: str, top_k: int = 5) -> List[Dict]:
-        """Retrieve most relevant chunks for a query"""
-        if not self.chunks:
-            return []
+    def _read_chunk_text(self, doc_id: int, chunk_num: int) -> str:
+        """Full text of one chunk, read from its document's memory-mapped shard"""
+        shard = pq.ParquetFile(self._shard_path(doc_id), memory_map=True)
+        # Rows were written in INGEST_BATCH_SIZE row groups; find the one holding chunk_num
+        row = chunk_num
+        for group in range(shard.num_row_groups):
+            rows = shard.metadata.row_group(group).num_rows
+            if row < rows:
+                return shard.read_row_group(group, columns=['text']).column('text')[row].as_py()
+            row -= rows
+        raise IndexError(f"Chunk {chunk_num} not found in shard for document {doc_id}")
+    
+    def _shard_term_block(self, doc_id: int) -> sp.csr_matrix:
+        """(chunks x terms) token counts of a document's shard, adding new tokens to the
+        vocabulary (caller holds _bm25_lock)"""
+        shard = pq.ParquetFile(self._shard_path(doc_id), memory_map=True)
+        term_ids = []
+        indptr = [0]
+        for record_batch in shard.iter_batches(batch_size=INGEST_BATCH_SIZE, columns=['text']):
+            for text in record_batch.column('text').to_pylist():
+                term_ids.extend(self._term_vocab.setdefault(token, len(self._term_vocab)) for token in tokenize(text))
+                indptr.append(len(term_ids))
+        num_terms = len(self._term_vocab)
+        
+        block = sp.csr_matrix((
+            # Counts fit in uint16: a chunk holds at most chunk_size words
+            np.ones(len(term_ids), dtype=np.uint16),
+            np.array(term_ids, dtype=np.int32),
+            np.array(indptr, dtype=np.int32)
+        ), shape=(len(indptr) - 1, num_terms))
+        # Repeated tokens become one entry holding their count
+        block.sum_duplicates()
+        return block
+    
+    def _refresh_bm25(self):
+        """Merge the per-document term counts into postings for the current rows"""
+        with self._bm25_lock:
+            with self._index_lock:
+                if self.index is None:
+                    # Below SQ_TRAIN_SIZE one sgemv over every row is cheaper than any pre-filter
+                    self._term_blocks = {}
+                    self._bm25 = None
+                    return
+                generation = self._corpus_generation
+                row_doc_ids = self.chunk_doc_ids
+                known_blocks = dict(self._term_blocks)
+            
+            # Rows run document by document, each document's chunks in order
+            doc_ids = [int(doc_id) for doc_id in row_doc_ids[np.flatnonzero(np.diff(row_doc_ids, prepend=-1))]]
+            try:
+                blocks = [
+                    known_blocks[doc_id] if doc_id in known_blocks else self._shard_term_block(doc_id)
+                    for doc_id in doc_ids
+                ]
+            except FileNotFoundError:
+                # A remove or clear deleted the shard meanwhile and refreshes again once done
+                return
+            
+            with self._index_lock:
+                # Documents removed meanwhile must not get their blocks back
+                for doc_id, block in zip(doc_ids, blocks):
+                    if doc_id in self.doc_names:
+                        self._term_blocks.setdefault(doc_id, block)
+            
+            offsets = np.cumsum([0] + [block.nnz for block in blocks])
+            counts = sp.csr_matrix((
+                np.concatenate([block.data for block in blocks]),
+                np.concatenate([block.indices for block in blocks]),
+                np.concatenate([[0]] + [block.indptr[1:] + offset for block, offset in zip(blocks, offsets)])
+            ), shape=(len(row_doc_ids), len(self._term_vocab)))
+            
+            chunk_lens = np.asarray(counts.sum(axis=1), dtype=np.float32).ravel()
+            length_norms = BM25_K1 * (1 - BM25_B + BM25_B * chunk_lens / max(chunk_lens.mean(), 1.0))
+            # Column-major, so a query term's postings are one contiguous slice
+            self._bm25 = (generation, counts.tocsc(), length_norms)
+    
+    def _ensure_bm25(self):
+        """Build postings in the background for a quantized index that has none yet"""
+        # After a restart the first search starts the build instead of startup
+        # tokenizing every shard; until it lands, searches use the whole graph
+        if self._bm25 is None and self.index is not None and not self._bm25_lock.locked():
+            threading.Thread(target=self._refresh_bm25, name='bm25_refresh', daemon=True).start()
+    
+    def _bm25_candidates(self, query: str):
+        """(corpus generation, row ids of the best BM25 matches), or None without postings"""
+        bm25 = self._bm25
+        if bm25 is None:
+            return None
+        generation, postings, length_norms = bm25
         
-        query_embedding = self.embedding_model.encode([query])[0]
-        chunk_embeddings = np.array([c['embedding'] for c in self.chunks])
-        similarities = cosine_similarity([query_embedding], chunk_embeddings)[0]
+        num_rows, num_terms = postings.shape
+        term_ids = {self._term_vocab.get(token) for token in tokenize(query)}
+        scores = np.zeros(num_rows, dtype=np.float32)
+        # Only the chunks containing a query term are touched
+        for term_id in term_ids:
+            if term_id is None or term_id >= num_terms:
+                continue
+            start, end = postings.indptr[term_id], postings.indptr[term_id + 1]
+            rows, tf = postings.indices[start:end], postings.data[start:end]
+            idf = np.log(1 + (num_rows - (end - start) + 0.5) / (end - start + 0.5))
+            scores[rows] += idf * tf * (BM25_K1 + 1) / (tf + length_norms[rows])
         
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        matches = np.flatnonzero(scores)
+        if len(matches) > BM25_CANDIDATES:
+            matches = matches[top_k_indices(scores[matches], BM25_CANDIDATES)]
+        return generation, matches.astype(np.int64)
+    
+    def retrieve_relevant_chunks(self, query: str, top_k: int = 5) -> Tuple[List[Dict], np.ndarray]:
+        """Retrieve most relevant chunks for a query, with their similarities as an array"""
+        query_embedding = self._embed_query(query)
+        self._ensure_bm25()
+        bm25_matches = self._bm25_candidates(query)
         
-        relevant_chunks = []
-        for idx in top_indices:
-            chunk = self.chunks[idx].copy()
-            chunk['similarity'] = float(similarities[idx])
-            del chunk['embedding']
-            relevant_chunks.append(chunk)
+        with self._index_lock:
+            top_k = min(top_k, self._num_vectors())
+            if top_k <= 0:
+                return [], np.empty(0, dtype=np.float32)
+            
+            candidates = None
+            if bm25_matches is not None:
+                generation, matches = bm25_matches
+                # Postings for an older corpus (a rebuild is under way) don't match the
+                # current rows; with fewer keyword matches than top_k, search everything
+                if generation == self._corpus_generation and len(matches) >= top_k:
+                    candidates = matches
+            
+            if self.index is None:
+                # Vectors are unit length, so cosine similarity is a single sgemv
+                similarities = self._emb_matrix @ query_embedding[0]
+                top_indices = top_k_indices(similarities, top_k)
+                scores, indices = similarities[top_indices], top_indices
+            elif candidates is not None:
+                # A graph walk filtered down to a few hundred ids loses most of its
+                # recall, so the candidates' decoded vectors are scored exactly instead
+                similarities = self.index.reconstruct_batch(candidates) @ query_embedding[0]
+                top_indices = top_k_indices(similarities, top_k)
+                scores, indices = similarities[top_indices], candidates[top_indices]
+            else:
+                # Results come back best-first; -1 pads the tail when fewer than top_k exist
+                scores, indices = self.index.search(query_embedding, top_k)
+                scores, indices = scores[0], indices[0]
+            
+            found = indices >= 0
+            indices = indices[found]
+            # Cosine similarity as before the index existed, with negative
+            # (unrelated) scores clipped to 0 so confidence and "% relevant" stay in [0, 1]
+            similarities = np.clip(scores[found], 0.0, 1.0).astype(np.float32)
+            
+            relevant_chunks = []
+            for idx, similarity in zip(indices, similarities):
+                doc_id = int(self.chunk_doc_ids[idx])
+                relevant_chunks.append({
+                    'doc_id': str(doc_id),
+                    'doc_name': self.doc_names[doc_id],
+                    'chunk_id': f"{doc_id}_{self.chunk_nums[idx]}",
+                    'text': self.chunk_heads[idx],
+                    'similarity': float(similarity)
+                })
+            
+            # The chunks that reach generate_answer get their full text from the shards
+            for chunk, idx in zip(relevant_chunks[:CONTEXT_CHUNKS], indices):
+                chunk['text'] = self._read_chunk_text(int(self.chunk_doc_ids[idx]), int(self.chunk_nums[idx]))
         
-        return relevant_chunks
+        return relevant_chunks, similarities
     
-    def call_groq_api(self, prompt: str) -> str:
-        """Call Groq API for answer generation"""
+    async def stream_groq_api(self, prompt: str) -> AsyncIterator[str]:
+        """Stream answer tokens from the Groq API as they are generated"""
         url = "https://api.groq.com/openai/v1/chat/completions"
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -137,13 +926,27 @@ class RAGEngine:
                 }
             ],
             "temperature": 0.5,
-            "max_tokens": 400
+            "max_tokens": 400,
+            "stream": True
         }
         
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        response.raise_for_status()
-        
-        return response.json()['choices'][0]['message']['content']
+        async with http_client.stream("POST", url, headers=headers, json=data) as response:
+            response.raise_for_status()
+            
+            # Server-sent events: one "data: {json}" line per delta, then "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                payload = line[len("data: "):]
+                if payload == "[DONE]":
+                    break
+                delta = json.loads(payload)['choices'][0]['delta'].get('content')
+                if delta:
+                    yield delta
+    
+    async def call_groq_api(self, prompt: str) -> str:
+        """Call Groq API for answer generation"""
+        return ''.join([delta async for delta in self.stream_groq_api(prompt)])
     
     def call_openai_api(self, prompt: str) -> str:
         """Call OpenAI API for answer generation"""
@@ -164,7 +967,7 @@ class RAGEngine:
     
     def generate_answer_simple(self, query: str, context_chunks: List[Dict]) -> str:
         """Simple answer generation without LLM (fallback)"""
-        top_chunks = context_chunks[:3]
+        top_chunks = context_chunks[:CONTEXT_CHUNKS]
         
         answer_parts = [
             f"Based on your documents, here's what I found regarding: '{query}'\n"
@@ -174,23 +977,23 @@ class RAGEngine:
             relevance = chunk['similarity'] * 100
             answer_parts.append(
                 f"\n📄 From '{chunk['doc_name']}' ({relevance:.0f}% relevant):\n"
-                f"{chunk['text'][:400]}{'...' if len(chunk['text']) > 400 else ''}\n"
+                f"{chunk['text'][:CHUNK_HEAD_CHARS]}{'...' if len(chunk['text']) > CHUNK_HEAD_CHARS else ''}\n"
             )
         
         return ''.join(answer_parts)
     
-    def generate_answer(self, query: str, context_chunks: List[Dict]) -> Dict:
-        """Generate answer using LLM with retrieved context"""
+    def build_prompt(self, query: str, context_chunks: List[Dict]) -> str:
+        """Build the LLM prompt from the query and retrieved context"""
         
         # FIXED: Limit context to avoid token limits (Groq has ~8k token limit)
         # Use only top 3 chunks and limit each chunk length
         limited_context = "\n\n".join([
-            f"[{chunk['doc_name']}]: {chunk['text'][:400]}"
-            for chunk in context_chunks[:3]
+            f"[{chunk['doc_name']}]: {chunk['text'][:CHUNK_HEAD_CHARS]}"
+            for chunk in context_chunks[:CONTEXT_CHUNKS]
         ])
         
         # FIXED: Shorter, more concise prompt
-        prompt = f"""Answer the question using these documents.
+        return f"""Answer the question using these documents.
 
 Context:
 {limited_context}
@@ -198,67 +1001,207 @@ Context:
 Question: {query}
 
 Answer briefly and clearly based on the context above."""
-
+    
+    def calculate_confidence(self, similarities: np.ndarray) -> float:
+        """Confidence score from the similarities of the retrieved chunks, best first"""
+        # IMPROVED: Better confidence calculation
+        # Weight top chunks more heavily
+        k = min(len(similarities), len(self._conf_weights))
+        weights = self._conf_weights[:k]
+        confidence = float(np.dot(similarities[:k], weights) / weights.sum())
+        
+        # Boost confidence if top chunk is very relevant
+        if similarities[0] > 0.7:
+            confidence = min(confidence * 1.15, 0.99)
+        
+        return confidence
+    
+    async def generate_answer_text(self, query: str, context_chunks: List[Dict]) -> Tuple[str, bool]:
+        """Answer text and whether it came from the LLM (False for the generate_answer_simple fallback)"""
+        prompt = self.build_prompt(query, context_chunks)
+        
         try:
             if not self.api_key:
-                answer = self.generate_answer_simple(query, context_chunks)
+                return self.generate_answer_simple(query, context_chunks), False
             elif self.api_provider == 'groq':
-                answer = self.call_groq_api(prompt)
+                return await self.call_groq_api(prompt), True
             else:
-                answer = self.call_openai_api(prompt)
+                # The legacy openai client is synchronous; keep it off the event loop
+                return await asyncio.to_thread(self.call_openai_api, prompt), True
                 
         except Exception as e:
             print(f"API Error: {e}")
             # Enhanced fallback
-            answer = self.generate_answer_simple(query, context_chunks)
-        
-        # IMPROVED: Better confidence calculation
-        # Weight top chunks more heavily
-        weights = [1.0, 0.8, 0.6, 0.4, 0.2]
-        weighted_scores = [
-            chunk['similarity'] * weights[i] 
-            for i, chunk in enumerate(context_chunks[:5])
-        ]
-        confidence = float(np.sum(weighted_scores) / np.sum(weights[:len(weighted_scores)]))
-        
-        # Boost confidence if top chunk is very relevant
-        if context_chunks[0]['similarity'] > 0.7:
-            confidence = min(confidence * 1.15, 0.99)
-        
+            return self.generate_answer_simple(query, context_chunks), False
+    
+    async def generate_answer(self, query: str, context_chunks: List[Dict], similarities: np.ndarray) -> Dict:
+        """Generate answer using LLM with retrieved context"""
+        answer, from_llm = await self.generate_answer_text(query, context_chunks)
         return {
             'answer': answer,
-            'confidence': confidence
+            'from_llm': from_llm,
+            'confidence': self.calculate_confidence(similarities)
         }
     
-    def search(self, query: str, top_k: int = 5) -> Dict:
+    async def generate_answer_stream(self, query: str, context_chunks: List[Dict]) -> AsyncIterator[Tuple[str, bool]]:
+        """Yield (text, from_llm) pieces of the answer; only Groq streams, other paths yield it whole"""
+        if not (self.api_key and self.api_provider == 'groq'):
+            yield await self.generate_answer_text(query, context_chunks)
+            return
+        
+        streamed = False
+        try:
+            async for delta in self.stream_groq_api(self.build_prompt(query, context_chunks)):
+                streamed = True
+                yield delta, True
+        except Exception as e:
+            print(f"API Error: {e}")
+            # Tokens already sent can't be retracted, so only fall back before the first one
+            if streamed:
+                raise
+            yield self.generate_answer_simple(query, context_chunks), False
+    
+    async def search(self, query: str, top_k: int = 5) -> Dict:
         """Main search function combining retrieval and generation"""
-        relevant_chunks = self.retrieve_relevant_chunks(query, top_k)
+        # Encoding and index access block (model forward pass, index lock), so
+        # they run on worker threads while the event loop serves other requests
+        query_embedding = await asyncio.to_thread(self._embed_query, query)
+        cached = self._lookup_cached_result(query_embedding, top_k)
+        if cached is not None:
+            return cached
+        generation = self._corpus_generation
+        
+        relevant_chunks, similarities = await asyncio.to_thread(self.retrieve_relevant_chunks, query, top_k)
         
         if not relevant_chunks:
             return {
-                'answer': 'No relevant information found in the indexed documents.',
+                'answer': NO_RESULTS_ANSWER,
                 'sources': [],
                 'confidence': 0.0,
-                'retrieved_chunks': []
+                'retrieved_chunks': [],
+                'cached': False
             }
         
-        result = self.generate_answer(query, relevant_chunks)
+        result = await self.generate_answer(query, relevant_chunks, similarities)
         sources = list(set([chunk['doc_name'] for chunk in relevant_chunks]))
         
-        return {
+        response = {
             'answer': result['answer'],
             'sources': sources,
             'confidence': result['confidence'],
-            'retrieved_chunks': relevant_chunks
+            'retrieved_chunks': relevant_chunks,
+            'cached': False
+        }
+        # A fallback answer may stem from a transient LLM error; don't pin it in the cache
+        if result['from_llm']:
+            self._cache_result(query_embedding, top_k, response, generation)
+        
+        return response
+    
+    async def search_stream(self, query: str, top_k: int = 5) -> AsyncIterator[Dict]:
+        """Streaming search: yields a 'meta' event, then 'delta' events carrying answer text"""
+        query_embedding = await asyncio.to_thread(self._embed_query, query)
+        cached = self._lookup_cached_result(query_embedding, top_k)
+        if cached is not None:
+            yield {'event': 'meta', **{k: v for k, v in cached.items() if k != 'answer'}}
+            yield {'event': 'delta', 'text': cached['answer']}
+            return
+        generation = self._corpus_generation
+        
+        relevant_chunks, similarities = await asyncio.to_thread(self.retrieve_relevant_chunks, query, top_k)
+        
+        if not relevant_chunks:
+            yield {'event': 'meta', 'sources': [], 'confidence': 0.0, 'retrieved_chunks': [], 'cached': False}
+            yield {'event': 'delta', 'text': NO_RESULTS_ANSWER}
+            return
+        
+        response = {
+            'sources': list(set([chunk['doc_name'] for chunk in relevant_chunks])),
+            'confidence': self.calculate_confidence(similarities),
+            'retrieved_chunks': relevant_chunks,
+            'cached': False
         }
+        yield {'event': 'meta', **response}
+        
+        answer_parts = []
+        from_llm = True
+        async for delta, delta_from_llm in self.generate_answer_stream(query, relevant_chunks):
+            answer_parts.append(delta)
+            from_llm = from_llm and delta_from_llm
+            yield {'event': 'delta', 'text': delta}
+        
+        if from_llm:
+            self._cache_result(query_embedding, top_k, {'answer': ''.join(answer_parts), **response}, generation)
     
     def remove_document(self, doc_id: str) -> bool:
         """Remove a document from the index"""
-        self.documents = [d for d in self.documents if d['id'] != doc_id]
-        self.chunks = [c for c in self.chunks if c['doc_id'] != doc_id]
+        try:
+            doc_id = int(doc_id)
+        except ValueError:
+            return False
+        
+        while True:
+            with self._index_lock:
+                if doc_id not in self.doc_names:
+                    return False
+                generation = self._corpus_generation
+                survivors = [int(d['id']) for d in self.documents if int(d['id']) != doc_id]
+            
+            # HNSW graphs do not support deletion, so the store is rebuilt from the
+            # surviving documents' exact shard embeddings (not from lossy SQ8 codes),
+            # without holding the lock while the graph is built
+            try:
+                vectors = np.concatenate(
+                    [self._read_shard_vectors(survivor) for survivor in survivors]
+                    or [np.empty((0, self.embedding_dim), dtype=np.float32)]
+                )
+            except FileNotFoundError:
+                with self._index_lock:
+                    if self._corpus_generation == generation:
+                        raise
+                # A concurrent remove or clear deleted a survivor's shard; start over
+                continue
+            index, emb_matrix = self._build_store(vectors)
+            
+            with self._index_lock:
+                if self._corpus_generation != generation:
+                    # Documents were added or removed meanwhile; rebuild from the new set
+                    continue
+                
+                self.documents = [d for d in self.documents if d['id'] != str(doc_id)]
+                del self.doc_names[doc_id]
+                self._invalidate_result_cache()
+                
+                keep = self.chunk_doc_ids != doc_id
+                self.index, self._emb_matrix = index, emb_matrix
+                self.chunk_heads = [head for head, k in zip(self.chunk_heads, keep) if k]
+                self.chunk_doc_ids = self.chunk_doc_ids[keep]
+                self.chunk_nums = self.chunk_nums[keep]
+                self._term_blocks.pop(doc_id, None)
+                self._save()
+                # Only once the saved snapshot no longer refers to it
+                os.remove(self._shard_path(doc_id))
+            break
+        
+        self._refresh_bm25()
         return True
     
     def clear_all(self):
         """Clear all documents and embeddings"""
-        self.documents = []
-        self.chunks = []
\ No newline at end of file
+        with self._index_lock:
+            removed_ids = list(self.doc_names)
+            self.documents = []
+            self.chunk_heads = []
+            self.chunk_doc_ids = np.empty(0, dtype=np.int32)
+            self.chunk_nums = np.empty(0, dtype=np.int32)
+            self.doc_names = {}
+            self._set_vectors(np.empty((0, self.embedding_dim), dtype=np.float32))
+            self._invalidate_result_cache()
+            for doc_id in removed_ids:
+                self._term_blocks.pop(doc_id, None)
+            self._save()
+            # Shards of ingests still in flight are not ours to delete
+            for doc_id in removed_ids:
+                os.remove(self._shard_path(doc_id))
+        
+        self._refresh_bm25()